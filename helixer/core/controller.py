@@ -45,12 +45,11 @@ class HelixerController(object):
         return coord_ids
 
     def _add_mers_of_seqid(self, coord_id, seqid, mers):
-        for mer_sequence, count in mers.items():
-            mer = Mer(coordinate_id=coord_id,
-                      mer_sequence=mer_sequence,
-                      count=count,
-                      length=len(mer_sequence))
-            self.session.add(mer)
+        rows = [{'coordinate_id': coord_id,
+                 'mer_sequence': mer_sequence,
+                 'count': count,
+                 'length': len(mer_sequence)} for mer_sequence, count in mers.items()]
+        Mer.bulk_insert(self.session, rows)
 
     def add_mer_counts_to_db(self):
         """Tries to add all kmer counts it can find for each coordinate in the db
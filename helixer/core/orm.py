@@ -1,5 +1,6 @@
 from geenuff import orm
-from sqlalchemy import Column, Integer, Float, ForeignKey, UniqueConstraint, CheckConstraint, String
+from sqlalchemy import (Column, Integer, SmallInteger, Float, ForeignKey, UniqueConstraint, CheckConstraint, String,
+                        Index)
 from sqlalchemy.orm import relationship
 
 
@@ -11,7 +12,7 @@ class Mer(orm.Base):
 
     mer_sequence = Column(String, nullable=False)
     count = Column(Integer)
-    length = Column(Integer)
+    length = Column(SmallInteger)  # bounded by the k-mer size
 
     coordinate = relationship('orm.Coordinate')
 
@@ -20,8 +21,17 @@ class Mer(orm.Base):
         CheckConstraint('length(mer_sequence) > 0', name='check_string_gt_0'),
         CheckConstraint('count >= 0', name='check_count_gt_0'),
         CheckConstraint('length >= 1', name='check_length_gt_1'),
+        # the unique constraint leads with mer_sequence, this makes per coordinate lookups index only
+        Index('ix_mer_coord_seq', 'coordinate_id', 'mer_sequence'),
     )
 
+    @classmethod
+    def bulk_insert(cls, session, mers):
+        """Inserts a list of dicts with the column values of many mers as one executemany through
+        SQLAlchemy Core, bypassing the per object overhead of the ORM"""
+        if mers:
+            session.execute(cls.__table__.insert(), mers)
+
     def __repr__(self):
         return '<Mer {}, coord_id: {}, seq: {}, count: {}, len: {}>'.format(self.id,
                                                                             self.coordinate_id,
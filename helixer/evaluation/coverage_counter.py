@@ -14,6 +14,7 @@ class CoverageCounter(object):
         self.lab_dim = lab_dim
         self.n_cov_bins = n_cov_bins
         self.coverage_bins = tuple(self.setup_coverage_bins(base_cov_bins, n_cov_bins))
+        self.coverage_bins_arr = np.array(self.coverage_bins)
         self.counts = self.setup_fully_binned_counts(lab_dim, n_cov_bins)
         self.latest = {}
         self.arrays = list(CoverageCounter.ARRAYS) + [(y, 'y'), (predictions, 'predictions')]
@@ -32,20 +33,8 @@ class CoverageCounter(object):
 
     @staticmethod
     def setup_fully_binned_counts(lab_dim, n_cov_bins):
-        list_y = []
-        # [argmax_gt][argmax_pred][i_covbin_ge][i_splicedcovbin_ge] = count
-        for i_y in range(lab_dim):
-            list_preds = []
-            for i_pred in range(lab_dim):
-                list_covs = []
-                for i_cov in range(n_cov_bins):
-                    list_scovs = []
-                    for i_scov in range(n_cov_bins):
-                        list_scovs.append(0)
-                    list_covs.append(list_scovs)
-                list_preds.append(list_covs)
-            list_y.append(list_preds)
-        return list_y
+        # [argmax_gt, argmax_pred, i_covbin_ge, i_splicedcovbin_ge] = count
+        return np.zeros((lab_dim, lab_dim, n_cov_bins, n_cov_bins), dtype=np.int64)
 
     @staticmethod
     def setup_coverage_bins(base=2, n=8):
@@ -63,41 +52,24 @@ class CoverageCounter(object):
         for key, array in self.latest.items():
             self.latest[key] = array[not_padded]
 
-    def mask_filtered_set(self, input_dict, mask_fn):
-        output = {}
-        for _, key in self.arrays:
-            mask = mask_fn(input_dict)
-            output[key] = input_dict[key][mask]
-        return output
-
-    # masking functions
-    @staticmethod
-    def mask_by_argmax(key, i):
-        def fn(input_dict):
-            return np.argmax(input_dict[key], axis=1) == i
-        return fn
-
-    @staticmethod
-    def mask_by_coverage(key, gr_eq):
-        def fn(input_dict):
-            return input_dict[key] >= gr_eq
-        return fn
+    def coverage_bin_idx(self, key):
+        """index of the highest coverage bin reached by each base, -1 if none is reached"""
+        # bins are ascending, so the number of bins <= coverage is one past the highest bin reached
+        return np.searchsorted(self.coverage_bins_arr, self.latest[key], side='right') - 1
 
     def increment(self):
-        for i_y in range(self.lab_dim):
-            filter_y_fn = self.mask_by_argmax('y', i_y)
-            filtered_y = self.mask_filtered_set(self.latest, filter_y_fn)
-            for i_p in range(self.lab_dim):
-                filter_p_fn = self.mask_by_argmax('predictions', i_p)
-                filtered_p = self.mask_filtered_set(filtered_y, filter_p_fn)
-                for i_c in range(self.n_cov_bins):
-                    filter_c_fn = self.mask_by_coverage('coverage', self.coverage_bins[i_c])
-                    filtered_c = self.mask_filtered_set(filtered_p, filter_c_fn)
-                    for i_sc in range(self.n_cov_bins):
-                        filter_sc_fn = self.mask_by_coverage('spliced_coverage',
-                                                             self.coverage_bins[i_sc])
-                        mask_sc = filter_sc_fn(filtered_c)
-                        self.counts[i_y][i_p][i_c][i_sc] += np.sum(mask_sc)
+        # find the bin of every base once and count all bin combinations in a single histogram
+        i_y = np.argmax(self.latest['y'], axis=1)
+        i_p = np.argmax(self.latest['predictions'], axis=1)
+        i_c = self.coverage_bin_idx('coverage')
+        i_sc = self.coverage_bin_idx('spliced_coverage')
+        binned = np.logical_and(i_c >= 0, i_sc >= 0)
+        flat_idx = np.ravel_multi_index((i_y[binned], i_p[binned], i_c[binned], i_sc[binned]), self.counts.shape)
+        exclusive = np.bincount(flat_idx, minlength=self.counts.size).reshape(self.counts.shape)
+        # counts are for coverage greater or equal to each bin, so accumulate from the highest bins down
+        cumulative = np.flip(exclusive, axis=(2, 3))
+        cumulative = np.cumsum(np.cumsum(cumulative, axis=2), axis=3)
+        self.counts += np.flip(cumulative, axis=(2, 3))
 
     def flatten(self):
         out = [['argmax_y', 'argmax_pred', 'coverage_greater_eq', 'spliced_coverage_greater_eq', 'count']]
@@ -109,11 +81,11 @@ class CoverageCounter(object):
                                     i_p,
                                     self.coverage_bins[i_c],
                                     self.coverage_bins[i_sc],
-                                    self.counts[i_y][i_p][i_c][i_sc]])
+                                    self.counts[i_y, i_p, i_c, i_sc]])
         return out
 
 
-def main(h5_file, out_file, preds_file, predictions='predictions', y='data/y'):
+def main(h5_file, out_file, preds_file, predictions='predictions', y='data/y', at_once=100):
     h5_data = h5py.File(h5_file, 'r')
     if preds_file is not None:
         preds_data = h5py.File(preds_file, 'r')
@@ -121,12 +93,11 @@ def main(h5_file, out_file, preds_file, predictions='predictions', y='data/y'):
         preds_data = h5_data
     cov_counter = CoverageCounter(lab_dim=4, n_cov_bins=6, base_cov_bins=3, predictions=predictions, y=y)
     n = h5_data['data/X'].shape[0]
-    for i in range(0, n, 100):
-        cov_counter.get_latest_arrays(i, h5_data, preds_data, 100)
+    for i in range(0, n, at_once):
+        cov_counter.get_latest_arrays(i, h5_data, preds_data, at_once)
         cov_counter.pre_filter_arrays()
         cov_counter.increment()
-        if not i % 500:
-            print('{} chunks of {} finished'.format(i, n))
+        print('{} chunks of {} finished'.format(min(i + at_once, n), n))
 
     with open(out_file, 'w') as f:
         writer = csv.writer(f)
@@ -143,5 +114,8 @@ if __name__ == "__main__":
                                                        '(but sort matching!) h5 file')
     parser.add_argument('--ground-truth-dataset', default='data/y')
     parser.add_argument('--predictions-dataset', default='predictions')
+    parser.add_argument('--chunks-at-once', type=int, default=100, help='number of chunks to read from the h5 '
+                                                                         'file(s) and count at once')
     args = parser.parse_args()
-    main(args.h5_data, args.out, args.h5_predictions, args.predictions_dataset, args.ground_truth_dataset)
+    main(args.h5_data, args.out, args.h5_predictions, args.predictions_dataset, args.ground_truth_dataset,
+         args.chunks_at_once)
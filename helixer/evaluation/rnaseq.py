@@ -2,7 +2,6 @@ import sys
 import argparse
 import HTSeq
 import h5py
-import copy
 import random
 import os
 import shutil
@@ -105,7 +104,7 @@ def cov_by_chrom(chromosome, htseqbam, d_utp=False, memmap_dirs=None):
     spliced_array = HTSeq.GenomicArray(chromosomes, stranded=True, typecode="i", storage=storage, memmap_dir=memmap_dirs[1])
     # 1 below because "pysam uses 0-based coordinates...The only exception is the region string in the fetch() and
     # pileup() methods. This string follows the convention of the samtools command line utilities." oh well.
-    counts = copy.deepcopy(COVERAGE_COUNTS)
+    counts = dict(COVERAGE_COUNTS)
     for read in htseqbam.fetch(region="{}:1-{}".format(chromosome, length)):
         if not skippable(read):
             counts['reads'] += 1
@@ -398,7 +397,7 @@ def main(species, bamfile, h5_input, h5_predictions, h5_output, d_utp=False):
     coords = gen_coords(h5_out)
     chunk_size = h5_out['evaluation/coverage'].shape[1]
 
-    counts = copy.deepcopy(COVERAGE_COUNTS)
+    counts = dict(COVERAGE_COUNTS)
     # setup dir for memmap array (AKA, don't try and store the whole chromosome in RAM
     memmap_dirs = ["memmap_dir_{}".format(random.getrandbits(128)),
                    "memmap_dir_{}".format(random.getrandbits(128))]
@@ -7,7 +7,6 @@ import random
 import os
 import shutil
 from helixer.evaluation import rnaseq
-import copy
 import logging
 
 
@@ -253,7 +252,7 @@ def main(species, bam, h5_data, d_utp, dont_score):
     # insert coverage into said regions
     coords = rnaseq.gen_coords(h5, species_start, species_end)
     print('start, end', species_start, species_end, file=sys.stderr)
-    cov_counts = copy.deepcopy(rnaseq.COVERAGE_COUNTS)  # tracks number reads, bp coverage, bp spliced coverage
+    cov_counts = dict(rnaseq.COVERAGE_COUNTS)  # tracks number reads, bp coverage, bp spliced coverage
     if bam is not None:
         chunk_size = h5['evaluation/coverage'].shape[1]
         # setup dir for memmap array (AKA, don't try and store the whole chromosome in RAM
@@ -0,0 +1,71 @@
+"""makes a copy of .h5 file with data/X stored as one uint8 code per base instead of 4 float16 values"""
+# the training sequences expand the codes again with the lookup table stored in the attrs of data/X,
+# this cuts the X read from disk during training 8x. Evaluation scripts that read data/X directly
+# still expect the original encoding, so keep the original file around for those
+
+import argparse
+import h5py
+import numpy as np
+
+from helixer.export.numerify import AMBIGUITY_DECODE
+
+
+def decode_lut():
+    # code 0 is reserved for padding, all the other codes follow AMBIGUITY_DECODE
+    encodings = [[0., 0., 0., 0.]] + list(AMBIGUITY_DECODE.values())
+    return np.array(encodings, dtype=np.float16)
+
+
+def encode(x, lut):
+    # compare the raw bits of all 4 float16 values of each base at once
+    keys = np.ascontiguousarray(x, dtype=np.float16).view(np.uint64)[..., 0]
+    lut_keys = lut.view(np.uint64)[:, 0]
+    order = np.argsort(lut_keys)
+    pos = np.searchsorted(lut_keys, keys, sorter=order)
+    codes = order[np.minimum(pos, len(order) - 1)]
+    assert np.all(lut_keys[codes] == keys), 'data/X holds an encoding that is not in AMBIGUITY_DECODE'
+    return codes.astype(np.uint8)
+
+
+def main(data, out, write_by):
+    old = h5py.File(data, mode='r')
+    new = h5py.File(out, mode='w')
+    old_x = old['data/X']
+    lut = decode_lut()
+
+    # simply copy everything but data/X
+    for key in old.keys():
+        bkey = key.encode('utf-8')
+        if key == 'data':
+            new.create_group('data')
+            for data_key in old['data'].keys():
+                if data_key != 'X':
+                    bkey = 'data/{}'.format(data_key).encode('utf-8')
+                    h5py.h5o.copy(old.id, bkey, new.id, bkey)
+        else:
+            h5py.h5o.copy(old.id, bkey, new.id, bkey)
+    for key, value in old.attrs.items():
+        new.attrs[key] = value
+
+    new_x = new.create_dataset('data/X',
+                               shape=old_x.shape[:2],
+                               maxshape=(None,) + old_x.shape[1:2],
+                               chunks=(1,) + old_x.shape[1:2],
+                               dtype=np.uint8,
+                               compression='lzf',
+                               shuffle=True)
+    new_x.attrs['decode_lut'] = lut
+    for start in range(0, old_x.shape[0], write_by):
+        end = min(start + write_by, old_x.shape[0])
+        new_x[start:end] = encode(old_x[start:end], lut)
+    old.close()
+    new.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--h5-data', '-d', type=str, required=True)
+    parser.add_argument('--h5-out', '-o', type=str, required=True)
+    parser.add_argument('--write-by', '-b', type=int, default=1000)
+    args = parser.parse_args()
+    main(args.h5_data, args.h5_out, args.write_by)
@@ -182,7 +182,7 @@ class HelixerExportController(object):
         """Splits the given coordinates in a train and val set. It does so by doing it individually for
         each the coordinates < N90 and >= N90 of each genome."""
         def N90_index(coords):
-            len_90_perc = int(sum([c[1] for c in coords]) * 0.9)
+            len_90_perc = int(sum(c[1] for c in coords) * 0.9)
             len_sum = 0
             for i, coord in enumerate(coords):
                 len_sum += coord[1]
@@ -364,7 +364,7 @@ class HelixerExportController(object):
         # make version without features for shorter downstream code
         genome_coords = {g_id: list(values.keys()) for g_id, values in genome_coord_features.items()}
 
-        n_coords = sum([len(coords) for genome_id, coords in genome_coords.items()])
+        n_coords = sum(len(coords) for coords in genome_coords.values())
         print('\n{} coordinates chosen to numerify'.format(n_coords))
         if self.match_existing:
             train_coords, val_coords = self._split_coords_by_existing(genome_coords=genome_coords)
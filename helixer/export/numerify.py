@@ -1,7 +1,9 @@
 """convert cleaned-db schema to numeric values describing gene structure"""
 
+import heapq
 import numpy as np
 import logging
+from collections import defaultdict
 from abc import ABC, abstractmethod
 
 from geenuff.base import types
@@ -25,6 +27,14 @@ AMBIGUITY_DECODE = {
     'N': [0.25, 0.25, 0.25, 0.25]
 }
 
+# AMBIGUITY_DECODE as a lookup table indexed by the ASCII code of each base, so whole
+# sequences can be numerified with a single fancy-indexing call. Soft masked (lower case)
+# bases are encoded like upper case ones and any unknown byte is encoded as N
+AMBIGUITY_LUT = np.full((256, 4), AMBIGUITY_DECODE['N'], dtype=np.float16)
+for _bp, _encoding in AMBIGUITY_DECODE.items():
+    AMBIGUITY_LUT[ord(_bp.upper())] = _encoding
+    AMBIGUITY_LUT[ord(_bp.lower())] = _encoding
+
 
 class Stepper(object):
     def __init__(self, end, by):
@@ -72,16 +82,15 @@ class Numerifier(ABC):
     def _slice_matrices(self, is_plus_strand, *argv):
         """Slices (potentially) multiple matrices in the same way according to self.paired_steps"""
         assert len(argv) > 0, 'Need a matrix to slice'
-        all_slices = [[] for _ in range(len(argv))]
-        # reverse steps on minus strand
-        steps = self.paired_steps if is_plus_strand else self.paired_steps[::-1]
-        for prev, current in steps:
-            for matrix, slices in zip(argv, all_slices):
-                data_slice = matrix[prev:current]
-                if not is_plus_strand:
-                    # invert directions
-                    data_slice = np.flip(data_slice, axis=0)
-                slices.append(data_slice)
+        # the steps are contiguous, so one split at every step end gives all (view) slices, plus the remainder
+        ends = [current for _, current in self.paired_steps]
+        all_slices = []
+        for matrix in argv:
+            slices = np.split(matrix, ends, axis=0)[:-1]
+            if not is_plus_strand:
+                # reverse steps and invert directions on minus strand
+                slices = [np.flip(data_slice, axis=0) for data_slice in slices[::-1]]
+            all_slices.append(slices)
         return all_slices
 
     def _zero_matrix(self):
@@ -97,10 +106,9 @@ class SequenceNumerifier(Numerifier):
 
     def coord_to_matrices(self):
         """Does not alter the error mask unlike in AnnotationNumerifier"""
-        self._zero_matrix()
         # plus strand, actual numerification of the sequence
-        for i, bp in enumerate(self.coord.sequence[self.start:self.end]):
-            self.matrix[i] = AMBIGUITY_DECODE[bp]
+        seq = np.frombuffer(self.coord.sequence[self.start:self.end].encode('ascii'), dtype=np.uint8)
+        self.matrix = AMBIGUITY_LUT[seq]
         # very important to copy here
         data_plus = self._slice_matrices(True,
                                          np.copy(self.matrix))[0]
@@ -125,6 +133,9 @@ class AnnotationNumerifier(Numerifier):
         types.GeenuffFeature.geenuff_cds: 1,
         types.GeenuffFeature.geenuff_intron: 2,
      }
+    # class of each transcript/cds/intron bit code: without transcript -> Intergenic, transcript only -> UTR,
+    # transcript and cds -> CDS, transcript and intron (with or without cds) -> Intron
+    ONEHOT4_CLASS_LUT = np.array([0, 1, 0, 2, 0, 3, 0, 3], dtype=np.int8)
     # todo, major refactor so that everything is handled in a symmetric fashion, and so that it's possible
     #  to skip onehot, sample_weights, gene_length, or transitions without a maze of if/else statements
     #  maybe have first pass & second pass matrix gen functions, and loop through those that exist at each step??
@@ -171,6 +182,11 @@ class AnnotationNumerifier(Numerifier):
         return matrices
 
     def _update_matrix_and_error_mask(self, is_plus_strand):
+        # collect the (cropped) intervals of all features in one pass, the error mask is handled as an extra column
+        error_col = self.n_cols
+        length = self.matrix.shape[0]
+        starts, ends, cols = [], [], []
+        transcripts = []
         for feature in self.features:
             # don't include features from the other strand
             if not feature.is_plus_strand == is_plus_strand:
@@ -182,53 +198,82 @@ class AnnotationNumerifier(Numerifier):
             # save ori length and crop to size
             gene_length = end - start
             start = max(start, 0)
-            end = min(end, self.matrix.shape[0])
+            end = min(end, length)
             if feature.type in AnnotationNumerifier.feature_to_col.keys():
                 col = AnnotationNumerifier.feature_to_col[feature.type]
-                self.matrix[start:end, col] = 1
             elif feature.type.value in types.geenuff_error_type_values:
-                self.error_mask[start:end] = 0
+                col = error_col
             else:
                 raise ValueError('Unknown feature type found: {}'.format(feature.type.value))
-            # also fill self.gene_lengths
-            # give precedence for the longer transcript if present
+            starts.append(start)
+            ends.append(end)
+            cols.append(col)
             if feature.type.value == types.GEENUFF_TRANSCRIPT:
-                length_arr = np.full(shape=(end - start,), fill_value=gene_length)
-                self.gene_lengths[start:end] = np.maximum(self.gene_lengths[start:end], length_arr)
+                transcripts.append((start, end, gene_length))
+
+        starts = np.array(starts, dtype=np.int64)
+        ends = np.array(ends, dtype=np.int64)
+        cols = np.array(cols, dtype=np.int64)
+        for col in range(self.n_cols):
+            is_col = cols == col
+            self.matrix[self._interval_mask(starts[is_col], ends[is_col], length), col] = 1
+        is_error = cols == error_col
+        self.error_mask[self._interval_mask(starts[is_error], ends[is_error], length)] = 0
+        # also fill self.gene_lengths
+        # give precedence for the longer transcript if present
+        self._fill_interval_max(self.gene_lengths, transcripts)
+
+    @staticmethod
+    def _interval_mask(starts, ends, length):
+        """boolean mask of all positions covered by any of the half open intervals [start, end)"""
+        non_empty = starts < ends
+        # +1 at each start and -1 at each end, so the cumulative sum is the number of covering intervals
+        diff = np.zeros((length + 1,), dtype=np.int32)
+        np.add.at(diff, starts[non_empty], 1)
+        np.add.at(diff, ends[non_empty], -1)
+        return np.cumsum(diff[:-1]) > 0
+
+    @staticmethod
+    def _fill_interval_max(arr, intervals):
+        """sets each position of arr covered by any (start, end, value) interval to the maximum value covering it,
+        with a sweep over the sorted interval borders instead of writing every interval in full"""
+        # at the same position, ends (0) are handled before starts (1)
+        borders = sorted([(start, 1, value) for start, end, value in intervals if start < end] +
+                         [(end, 0, value) for start, end, value in intervals if start < end])
+        active = []  # max heap of the values of the intervals covering the current position
+        ended = defaultdict(int)  # values of intervals that ended, but are still in the heap
+        prev_pos = 0
+        for pos, is_start, value in borders:
+            if active and pos > prev_pos:
+                arr[prev_pos:pos] = -active[0]
+            prev_pos = pos
+            if is_start:
+                heapq.heappush(active, -value)
+            else:
+                ended[value] += 1
+            # lazily remove ended intervals once they would be the maximum
+            while active and ended[-active[0]]:
+                ended[-active[0]] -= 1
+                heapq.heappop(active)
 
     def _encode_onehot4(self):
         # Class order: Intergenic, UTR, CDS, (non-coding Intron), Intron
-        # This could be done in a more efficient way, but this way we may catch bugs
-        # where non-standard classes are output in the multiclass output
-        one_hot_matrix = np.zeros((self.matrix.shape[0], 4), dtype=bool)
-        col_0, col_1, col_2 = self.matrix[:, 0], self.matrix[:, 1], self.matrix[:, 2]
-        # Intergenic
-        one_hot_matrix[:, 0] = np.logical_not(col_0)
-        # UTR
-        genic_non_coding = np.logical_and(col_0, np.logical_not(col_1))
-        one_hot_matrix[:, 1] = np.logical_and(genic_non_coding, np.logical_not(col_2))
-        # CDS
-        one_hot_matrix[:, 2] = np.logical_and(np.logical_and(col_0, col_1), np.logical_not(col_2))
-        # Introns
-        one_hot_matrix[:, 3] = np.logical_and(col_0, col_2)
-        assert np.all(np.count_nonzero(one_hot_matrix, axis=1) == 1)
-
-        one_hot4_matrix = one_hot_matrix.astype(np.int8)
+        # read the transcript, cds and intron columns as bits 0, 1 and 2 of a code and map it to the class
+        code = self.matrix[:, 0] | (self.matrix[:, 1] << 1) | (self.matrix[:, 2] << 2)
+        classes = AnnotationNumerifier.ONEHOT4_CLASS_LUT[code]
+        one_hot4_matrix = np.eye(4, dtype=np.int8)[classes]
         return one_hot4_matrix
-    
+
     def _encode_transitions(self):
-        add = np.array([[0, 0, 0]])
-        shifted_feature_matrix = np.vstack((self.matrix[1:], add))
-
-        y_is_transition = np.logical_xor(self.matrix[:-1], shifted_feature_matrix[:-1]).astype(np.int8)
-        y_direction_zero_to_one = np.logical_and(y_is_transition, self.matrix[1:]).astype(np.int8)
-        y_direction_one_to_zero = np.logical_and(y_is_transition, self.matrix[:-1]).astype(np.int8)
-        stack = np.hstack((y_direction_zero_to_one, y_direction_one_to_zero))
-
-        add2 = np.array([[0, 0, 0, 0, 0, 0]])
-        shape_stack = np.insert(stack, 0, add2, axis=0).astype(np.int8)
-        shape_end_stack = np.insert(stack, len(stack), add2, axis=0).astype(np.int8)
-        binary_transitions = np.logical_or(shape_stack, shape_end_stack).astype(np.int8)
+        # compare every position with the next one, directly on views of the matrix
+        prev, current = self.matrix[:-1], self.matrix[1:]
+        transitions = np.empty((prev.shape[0], 6), dtype=bool)
+        np.greater(current, prev, out=transitions[:, :3])  # direction zero to one
+        np.greater(prev, current, out=transitions[:, 3:])  # direction one to zero
+        # mark the positions on both sides of each transition
+        binary_transitions = np.zeros((self.matrix.shape[0], 6), dtype=np.int8)
+        binary_transitions[1:] = transitions
+        binary_transitions[:-1] |= transitions
         return binary_transitions  # 6 columns, one for each switch (+TR, +CDS, +In, -TR, -CDS, -In)
 
 
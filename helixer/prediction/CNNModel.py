@@ -10,9 +10,9 @@ class CNNSequence(HelixerSequence):
 # things in here may not work anymore
     def __getitem__(self, idx):
         assert self.exclude_errors  # no other way of dealing with errors in a CNN
-        usable_idx_slice = self.usable_idx[idx * self.batch_size:(idx + 1) * self.batch_size]
-        X = np.stack(self.x_dset[sorted(list(usable_idx_slice))])  # got to provide a sorted list of idx
-        y = np.stack(self.y_dset[sorted(list(usable_idx_slice))])
+        usable_idx_batch = self._usable_idx_batch(idx)
+        X = self._get_x(usable_idx_batch)
+        y = self.y_dset[usable_idx_batch]
         return X, y
 
 
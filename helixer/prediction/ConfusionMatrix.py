@@ -3,20 +3,20 @@ import os
 import csv
 from collections import defaultdict
 from terminaltables import AsciiTable
-from sklearn.metrics import confusion_matrix
 
 
 class ConfusionMatrix():
     def __init__(self, generator):
         np.set_printoptions(suppress=True)  # do not use scientific notation for the print out
         self.generator = generator
-        self.cm = np.zeros((4, 4))
+        self.cm = np.zeros((4, 4), dtype=np.int64)  # exact counts, also for very large genomes
         self.col_names = {0: 'ig', 1: 'utr', 2: 'exon', 3: 'intron'}
 
     @staticmethod
     def _reshape_data(arr):
-        arr = np.argmax(arr, axis=-1).astype(np.int8)
-        arr = arr.reshape((arr.shape[0], -1)).ravel()
+        # keep argmax's native integer type, an int8 copy would just be cast back up for counting
+        # argmax output is contiguous, so flattening it is a view and not a copy
+        arr = np.argmax(arr, axis=-1).reshape(-1)
         return arr
 
     @staticmethod
@@ -34,7 +34,9 @@ class ConfusionMatrix():
         if y_pred.size > 0:
             y_pred = ConfusionMatrix._reshape_data(y_pred)
             y_true = ConfusionMatrix._reshape_data(y_true)
-            self.cm += confusion_matrix(y_true, y_pred, labels=range(4))
+            # count each (true, predicted) pair via its index in the flattened 4x4 matrix
+            cm_idx = y_true * 4 + y_pred
+            self.cm += np.bincount(cm_idx, minlength=4 * 4).reshape((4, 4))
 
     def count_and_calculate_one_batch(self, y_true, y_pred, sw):
         self._add_to_cm(y_true, y_pred, sw)
@@ -91,14 +93,14 @@ class ConfusionMatrix():
         # pretty redundant code to below, but done for minimizing the risk to mess up (for now)
         d = scores['sub_genic']
         for base_metric in ['TP', 'FP', 'FN']:
-            d[base_metric] = sum([scores[m][base_metric] for m in ['exon', 'intron']])
+            d[base_metric] = sum(scores[m][base_metric] for m in ['exon', 'intron'])
         add_to_scores(d)
 
         # genic metrics are calculated by summing up TP, FP, FN, essentially calculating a weighted
         # sum for the individual metrics. TP of the intergenic class are not taken into account
         d = scores['genic']
         for base_metric in ['TP', 'FP', 'FN']:
-            d[base_metric] = sum([scores[m][base_metric] for m in ['utr', 'exon', 'intron']])
+            d[base_metric] = sum(scores[m][base_metric] for m in ['utr', 'exon', 'intron'])
         add_to_scores(d)
 
         return scores
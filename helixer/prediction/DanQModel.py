@@ -16,7 +16,8 @@ class DanQSequence(HelixerSequence):
 
     def __getitem__(self, idx):
         X, y, sw, _, transitions, _, _ = self._get_batch_data(idx)
-        pool_size = self.model.pool_size
+        # every LSTM timestep predicts the bases of both pooling steps
+        pool_size = self.model.pool_size * self.model.lstm_pool_size
 
         if pool_size > 1:
             if y.shape[1] % pool_size != 0:
@@ -36,20 +37,22 @@ class DanQSequence(HelixerSequence):
                 y.shape[-1],
             ))
  
+            # a timestep is only valid if none of its bases is marked as error
             sw = sw.reshape((sw.shape[0], -1, pool_size))
-            sw = np.logical_not(np.any(sw == 0, axis=2)).astype(np.int8)
+            # bool and int8 share their layout, so view instead of copying via astype
+            sw = np.all(sw, axis=2).view(np.int8)
 
             if self.class_weights is not None:
                 # class weights are additive for the individual timestep predictions
                 # giving even more weight to transition points
                 # class weights without pooling not supported yet
                 # cw = np.array([1.0, 1.2, 1.0, 0.8], dtype=np.float32)
-                cls_arrays = [np.any((y[:, :, :, col] == 1), axis=2) for col in range(4)]
-                cls_arrays = np.stack(cls_arrays, axis=2).astype(np.int8)
-                # add class weights to applicable timesteps
-                cw_arrays = np.multiply(cls_arrays, np.tile(self.class_weights, y.shape[:2] + (1,)))
-                cw = np.sum(cw_arrays, axis=2)
-                sw = np.multiply(cw, sw)
+                # whether a class is present anywhere in the pooled timestep
+                cls_arrays = np.any(y == 1, axis=2).view(np.int8)
+                # add class weights to applicable timesteps, summing over classes without an intermediate array
+                cw = np.einsum('btc,c->bt', cls_arrays, self.class_weights)
+                cw *= sw  # cw is freshly allocated, so weight it in place
+                sw = cw
 
             if self.transition_weights is not None:
                 transitions = transitions.reshape((
@@ -60,8 +63,7 @@ class DanQSequence(HelixerSequence):
                 ))
                 # todo, this looks very redundant with LSTMModel around _squish_tw_to_sw
                 #   could both go to HelixerModel?
-                sw_t = [np.any((transitions[:, :, :, col] == 1), axis=2) for col in range(6)]
-                sw_t = np.stack(sw_t, axis=2).astype(np.int8)
+                sw_t = np.any(transitions == 1, axis=2).view(np.int8)
                 sw_t = np.multiply(sw_t, self.transitions)
 
                 sw_t = np.sum(sw_t, axis=2)
@@ -80,18 +82,28 @@ class DanQModel(HelixerModel):
         self.parser.add_argument('--kernel-size', type=int, default=26)
         self.parser.add_argument('--cnn-layers', type=int, default=1)
         self.parser.add_argument('--pool-size', type=int, default=10)
+        self.parser.add_argument('--lstm-pool-size', type=int, default=1)  # further downsampling before the LSTM
         self.parser.add_argument('--dropout1', type=float, default=0.0)
         self.parser.add_argument('--dropout2', type=float, default=0.0)
         self.parser.add_argument('--layer-normalization', action='store_true')
+        self.parser.add_argument('--static-length', action='store_true')  # fix the input length to the chunk size
         self.parse_args()
+        if self.units % 32 != 0:
+            # small or unaligned hidden sizes keep cuDNN from its fast (persistent / tensor core) LSTM kernels
+            units = (self.units // 32 + 1) * 32
+            print(f'WARNING: rounding --units {self.units} up to {units}, a multiple of 32')
+            self.units = units
 
     @staticmethod
     def sequence_cls():
         return DanQSequence
 
     def model(self):
-        overhang = self.shape_train[1] % self.pool_size
-        main_input = Input(shape=(None, 4), dtype=self.float_precision,
+        overhang = self.shape_train[1] % (self.pool_size * self.lstm_pool_size)
+        # a fully known input shape lets the graph optimizations (e.g. --xla) specialize on the number of timesteps,
+        # but the model can then only predict on data with the same chunk size
+        length = self.shape_train[1] - overhang if self.static_length else None
+        main_input = Input(shape=(length, 4), dtype=self.float_precision,
                            name='main_input')
         x = Conv1D(filters=self.filter_depth,
                    kernel_size=self.kernel_size,
@@ -106,18 +118,24 @@ class DanQModel(HelixerModel):
                        padding="same",
                        activation="relu")(x)
 
+        # DanQSequence clips every input to a multiple of the pool sizes, so no pooling window needs padding
         if self.pool_size > 1:
-            x = MaxPooling1D(pool_size=self.pool_size, padding='same')(x)
+            x = MaxPooling1D(pool_size=self.pool_size, padding='valid')(x)
 
         if self.layer_normalization:
             x = LayerNormalization()(x)
         x = Dropout(self.dropout1)(x)
 
+        # fewer timesteps make the (sequential) LSTM proportionally cheaper
+        if self.lstm_pool_size > 1:
+            x = MaxPooling1D(pool_size=self.lstm_pool_size, padding='valid')(x)
+
         x = Bidirectional(CuDNNLSTM(self.units, return_sequences=True))(x)
         x = Dropout(self.dropout2)(x)
 
-        x = Dense(self.pool_size * 4)(x)
-        x = Reshape((-1, self.pool_size, 4))(x)
+        bases_per_timestep = self.pool_size * self.lstm_pool_size
+        x = Dense(bases_per_timestep * 4)(x)
+        x = Reshape((-1, bases_per_timestep, 4))(x)
         x = Activation('softmax', name='main')(x)
 
         outputs = [x]
@@ -12,11 +12,9 @@ class DilatedCNNSequence(HelixerSequence):
         X, y, sw, _, _, _, = self._get_batch_data(idx)
 
         if self.class_weights is not None:
-            cls_arrays = [y[:, :, col] == 1 for col in range(4)]  # whether a class is present
-            cls_arrays = np.stack(cls_arrays, axis=2).astype(np.int8)
-            # add class weights to applicable timesteps
-            cw_arrays = np.multiply(cls_arrays, np.tile(self.class_weights, y.shape[:2] + (1,)))
-            cw = np.sum(cw_arrays, axis=-1)
+            cls_arrays = (y == 1).astype(np.int8)  # whether a class is present
+            # add class weights to applicable timesteps, summing over classes without an intermediate array
+            cw = np.einsum('btc,c->bt', cls_arrays, self.class_weights)
             # multiply with previous sample weights
             sw = np.multiply(sw, cw)
 
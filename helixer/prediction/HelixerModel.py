@@ -5,6 +5,10 @@ try:
     import nni
 except ImportError:
     pass
+try:
+    import horovod.keras as hvd
+except ImportError:
+    pass
 import time
 import h5py
 import random
@@ -16,31 +20,36 @@ import numpy as np
 import tensorflow as tf
 from pprint import pprint
 from tensorflow.python.client import timeline
+from tensorflow.core.protobuf import rewriter_config_pb2
 
 from keras_layer_normalization import LayerNormalization
 from keras.callbacks import Callback
 from keras import optimizers
 from keras import backend as K
 from keras.models import load_model
-from keras.utils import multi_gpu_model, Sequence
+from keras.utils import multi_gpu_model, Sequence, OrderedEnqueuer
 
 from helixer.prediction.ConfusionMatrix import ConfusionMatrix
 
 
 class SaveEveryEpoch(Callback):
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, include_optimizer=True):
         super(SaveEveryEpoch, self).__init__()
         self.output_dir = output_dir
+        self.include_optimizer = include_optimizer
 
     def on_epoch_end(self, epoch, _):
         path = os.path.join(self.output_dir, f'model{epoch}.h5')
-        self.model.save(path)
+        self.model.save(path, include_optimizer=self.include_optimizer)
         print(f'saved model at {path}')
 
 
 class ConfusionMatrixTrain(Callback):
-    def __init__(self, save_model_path, val_generator, canary_generator=None, report_to_nni=False):
+    def __init__(self, save_model_path, val_generator, canary_generator=None, report_to_nni=False,
+                 save_model=True, include_optimizer=True):
         self.save_model_path = save_model_path
+        self.save_model = save_model
+        self.include_optimizer = include_optimizer
         self.val_generator = val_generator
         self.canary_generator = canary_generator
         self.report_to_nni = report_to_nni
@@ -56,9 +65,10 @@ class ConfusionMatrixTrain(Callback):
             nni.report_intermediate_result(val_genic_f1)
         if val_genic_f1 > self.best_val_genic_f1:
             self.best_val_genic_f1 = val_genic_f1
-            self.model.save(self.save_model_path)
-            print('saved new best model with genic f1 of {} at {}'.format(self.best_val_genic_f1,
-                                                                          self.save_model_path))
+            if self.save_model:
+                self.model.save(self.save_model_path, include_optimizer=self.include_optimizer)
+                print('saved new best model with genic f1 of {} at {}'.format(self.best_val_genic_f1,
+                                                                              self.save_model_path))
             self.epochs_without_improvement = 0
         else:
             self.epochs_without_improvement += 1
@@ -80,12 +90,18 @@ class HelixerSequence(Sequence):
         self.model = model
         self.h5_file = h5_file
         self.mode = mode
+        self.shuffle = shuffle
         self._cp_into_namespace(['batch_size', 'float_precision', 'class_weights', 'transition_weights',
                                  'stretch_transition_weights', 'coverage_weights', 'coverage_offset',
                                  'overlap', 'overlap_offset', 'core_length', 'min_seqs_for_overlapping',
                                  'debug', 'exclude_errors', 'error_weights', 'gene_lengths',
                                  'gene_lengths_average', 'gene_lengths_exponent', 'gene_lengths_cutoff'])
         self.x_dset = h5_file['/data/X']
+        # X compressed to one uint8 code per base (see helixer/export/compress_x.py) is expanded with its lookup table
+        if self.x_dset.dtype == np.uint8:
+            self.x_decode_lut = np.array(self.x_dset.attrs['decode_lut'], dtype=np.float16)
+        else:
+            self.x_decode_lut = None
         self.y_dset = h5_file['/data/y']
         self.sw_dset = h5_file['/data/sample_weights']
         self.seqids_dset = h5_file['/data/seqids']
@@ -102,9 +118,18 @@ class HelixerSequence(Sequence):
         if self.exclude_errors:
             self.usable_idx = np.flatnonzero(np.array(h5_file['/data/err_samples']) == False)
         else:
-            self.usable_idx = list(range(self.x_dset.shape[0]))
+            self.usable_idx = np.arange(self.x_dset.shape[0])
 
         print('Total chunks: {}'.format(len(self.usable_idx)))
+        if self.mode == 'train' and self.model.horovod:
+            # every worker trains on its own shard of the data, all of the same size, as a worker with an extra
+            # step would wait forever for the others in the gradient allreduce (so drop < hvd.size() chunks)
+            n_even = len(self.usable_idx) - len(self.usable_idx) % hvd.size()
+            self.usable_idx = self.usable_idx[:n_even][hvd.rank()::hvd.size()]
+            print('Chunks of this worker: {}'.format(len(self.usable_idx)))
+            n_batches = hvd.allgather(np.array([len(self)]))
+            assert np.all(n_batches == len(self)), 'Workers have different numbers of batches: {}'.format(n_batches)
+
         if shuffle:
             random.shuffle(self.usable_idx)
 
@@ -116,14 +141,23 @@ class HelixerSequence(Sequence):
     def _usable_idx_batch(self, idx):
         n_seqs = self._seqs_per_batch()
         usable_idx_slice = self.usable_idx[idx * n_seqs:(idx + 1) * n_seqs]
-        usable_idx_slice = sorted(list(usable_idx_slice))  # got to always provide a sorted list of idx
-        return usable_idx_slice
+        if not self.shuffle:
+            # usable_idx is created in ascending order and only shuffling changes that
+            return usable_idx_slice
+        # got to always provide sorted idx, as an array h5py can use for fancy indexing directly
+        return np.sort(usable_idx_slice)
+
+    def _get_x(self, usable_idx_batch):
+        X = self.x_dset[usable_idx_batch]
+        if self.x_decode_lut is not None:
+            X = self.x_decode_lut[X]
+        return X
 
     def _get_batch_data(self, idx):
         usable_idx_batch = self._usable_idx_batch(idx)
         if self.overlap:
-            X = self.x_dset[usable_idx_batch]
-            seqid_borders = self._get_seqid_borders(idx)
+            X = self._get_x(usable_idx_batch)
+            seqid_borders = self._get_seqid_borders(idx, usable_idx_batch)
             # split data along these borders
             X_by_seqid = np.array_split(X, seqid_borders)
             overlapping_X = []
@@ -139,7 +173,7 @@ class HelixerSequence(Sequence):
                     overlapping_X += [seqid_x[i] for i in range(len(seqid_x))]
             X = np.stack(overlapping_X)
         else:
-            X = self.x_dset[usable_idx_batch]
+            X = self._get_x(usable_idx_batch)
 
         y = self.y_dset[usable_idx_batch]
         sw = self.sw_dset[usable_idx_batch]
@@ -162,8 +196,10 @@ class HelixerSequence(Sequence):
 
         return X, y, sw, error_rates, gene_lengths, transitions, coverage_scores
 
-    def _get_seqid_borders(self, idx):
-        seqids = self.seqids_dset[self._usable_idx_batch(idx)]
+    def _get_seqid_borders(self, idx, usable_idx_batch=None):
+        if usable_idx_batch is None:
+            usable_idx_batch = self._usable_idx_batch(idx)
+        seqids = self.seqids_dset[usable_idx_batch]
         idx_border = np.argwhere(seqids[:-1] != seqids[1:])[:, 0]
         if len(idx_border) > 0:
             # if there are changes in seqid
@@ -224,6 +260,8 @@ class HelixerModel(ABC):
         self.parser.add_argument('-l', '--load-model-path', type=str, default='')
         self.parser.add_argument('-t', '--test-data', type=str, default='')
         self.parser.add_argument('-p', '--prediction-output-path', type=str, default='predictions.h5')
+        self.parser.add_argument('--prediction-dtype', type=str, default='float32',
+                                 choices=['float32', 'float16', 'uint8'])
         self.parser.add_argument('--eval', action='store_true')
         # overlap options
         self.parser.add_argument('--overlap', action='store_true')
@@ -237,11 +275,18 @@ class HelixerModel(ABC):
         self.parser.add_argument('--gene-lengths-cutoff', type=float, default=5.0)
         # resources
         self.parser.add_argument('--float-precision', type=str, default='float32')
+        self.parser.add_argument('--amp', action='store_true')  # float16 compute with float32 variables
+        self.parser.add_argument('--loss-scale', type=str, default='dynamic')  # 'dynamic' or 'static:N', for --amp
+        self.parser.add_argument('--xla', action='store_true')  # jit compile and fuse the supported ops
+        self.parser.add_argument('--horovod', action='store_true')  # one process per gpu, launch with horovodrun
         self.parser.add_argument('--gpus', type=int, default=1)
         self.parser.add_argument('--cpus', type=int, default=8)
         self.parser.add_argument('--gpu-id', type=int, default=-1)
+        self.parser.add_argument('--workers', type=int, default=0)  # threads prefetching training batches
+        self.parser.add_argument('--h5-cache-mb', type=int, default=0)  # training file chunk cache, 0: h5py default
         # misc flags
         self.parser.add_argument('--save-every-epoch', action='store_true')
+        self.parser.add_argument('--save-without-optimizer', action='store_true')
         self.parser.add_argument('--nni', action='store_true')
         self.parser.add_argument('--trace', action='store_true')
         self.parser.add_argument('-v', '--verbose', action='store_true')
@@ -254,10 +299,13 @@ class HelixerModel(ABC):
         assert not (self.testing and self.data_dir)
         assert not (not self.testing and self.test_data)
         assert not (self.resume_training and (not self.load_model_path or not self.data_dir))
+        assert not (self.amp and self.float_precision != 'float32'), 'AMP needs float32 variables'
+        assert self.loss_scale == 'dynamic' or self.loss_scale.startswith('static:'), 'Unknown loss scale'
+        assert not (self.horovod and (self.gpus > 1 or self.amp)), 'Horovod runs one gpu per process and no AMP'
 
         if self.nni:
             hyperopt_args = nni.get_next_parameter()
-            assert all([key in args for key in hyperopt_args.keys()]), 'Unknown nni parameter'
+            assert all(key in args for key in hyperopt_args.keys()), 'Unknown nni parameter'
             self.__dict__.update(hyperopt_args)
             nni_save_model_path = os.path.expandvars('$NNI_OUTPUT_DIR/best_model.h5')
             nni_pred_output_path = os.path.expandvars('$NNI_OUTPUT_DIR/predictions.h5')
@@ -269,7 +317,8 @@ class HelixerModel(ABC):
             args['prediction_output_path'] = nni_pred_output_path
 
         self.class_weights = eval(self.class_weights)
-        if type(self.class_weights) is list:
+        if type(self.class_weights) in [list, tuple]:
+            # cached as a 1D float32 array so the sequences can broadcast it against the labels directly
             self.class_weights = np.array(self.class_weights, dtype=np.float32)
 
         self.transition_weights = eval(self.transition_weights)
@@ -282,16 +331,33 @@ class HelixerModel(ABC):
 
     def generate_callbacks(self):
         canary_gen = self.gen_canary_data() if self.canary_dataset else None
+        # all workers validate so they stop at the same time, but only the first one saves and reports
+        is_root = not self.horovod or hvd.rank() == 0
+        # saved models are still complete, but without optimizer state they are a third of the size
+        include_optimizer = not self.save_without_optimizer
         callbacks = [ConfusionMatrixTrain(self.save_model_path, self.gen_validation_data(),
-                                          canary_gen, report_to_nni=self.nni)]
-        if self.save_every_epoch:
-            callbacks.append(SaveEveryEpoch(os.path.dirname(self.save_model_path)))
+                                          canary_gen, report_to_nni=self.nni and is_root, save_model=is_root,
+                                          include_optimizer=include_optimizer)]
+        if self.horovod:
+            # start all workers from the weights of the first one
+            callbacks.insert(0, hvd.callbacks.BroadcastGlobalVariablesCallback(0))
+        if self.save_every_epoch and is_root:
+            callbacks.append(SaveEveryEpoch(os.path.dirname(self.save_model_path), include_optimizer))
         return callbacks
 
     def set_resources(self):
         from keras.backend.tensorflow_backend import set_session
         config = tf.ConfigProto()
         config.gpu_options.allow_growth = True  # dynamically grow the memory used on the GPU
+        if self.horovod:
+            hvd.init()
+            config.gpu_options.visible_device_list = str(hvd.local_rank())
+        if self.amp:
+            # grappler inserts the float16 casts for all ops that are safe to run on tensor cores
+            config.graph_options.rewrite_options.auto_mixed_precision = rewriter_config_pb2.RewriterConfig.ON
+        if self.xla:
+            # auto-clustering leaves ops XLA can not compile (e.g. the cuDNN LSTM) to the regular kernels
+            config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
         sess = tf.Session(config=config)
         set_session(sess)  # set this TensorFlow session as the default session for Keras
 
@@ -300,6 +366,23 @@ class HelixerModel(ABC):
             os.environ['CUDA_DEVICE_ORDER'] = 'PCI_BUS_ID'
             os.environ['CUDA_VISIBLE_DEVICES'] = str(self.gpu_id)
 
+    def set_optimizer(self):
+        if self.amp:
+            # loss scaling keeps small float16 gradients from underflowing, it needs a tf optimizer to wrap
+            # note that this path does not clip gradients and its state is not saved with the model
+            if self.loss_scale == 'dynamic':
+                loss_scale = 'dynamic'
+            else:
+                loss_scale = float(self.loss_scale.split(':')[1])
+            optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate)
+            optimizer = tf.train.experimental.MixedPrecisionLossScaleOptimizer(optimizer, loss_scale)
+            self.optimizer = optimizers.TFOptimizer(optimizer)
+        else:
+            self.optimizer = optimizers.Adam(lr=self.learning_rate, clipnorm=self.clip_norm)
+            if self.horovod:
+                # averages the gradients of all workers with an allreduce
+                self.optimizer = hvd.DistributedOptimizer(self.optimizer)
+
     def gen_training_data(self):
         SequenceCls = self.sequence_cls()
         return SequenceCls(model=self,
@@ -372,7 +455,14 @@ class HelixerModel(ABC):
             return n_fully_ig
 
         if not self.testing:
-            self.h5_train = h5py.File(os.path.join(self.data_dir, 'training_data.h5'), 'r')
+            train_path = os.path.join(self.data_dir, 'training_data.h5')
+            if self.h5_cache_mb > 0:
+                # a chunk cache large enough for several batches keeps decompressed chunks around for reuse
+                # (rdcc_nslots should be a prime, ~100x the number of chunks that fit into the cache)
+                self.h5_train = h5py.File(train_path, 'r', rdcc_nbytes=self.h5_cache_mb * 1024**2,
+                                          rdcc_nslots=1000003, rdcc_w0=0.75)
+            else:
+                self.h5_train = h5py.File(train_path, 'r')
             self.h5_val = h5py.File(os.path.join(self.data_dir, 'validation_data.h5'), 'r')
             self.shape_train = self.h5_train['/data/X'].shape
             self.shape_val = self.h5_val['/data/X'].shape
@@ -431,7 +521,7 @@ class HelixerModel(ABC):
         n_original_seqs = test_sequence._seqs_per_batch(batch_idx=batch_idx)
         n_overlapping_seqs = self.core_length // self.overlap_offset
 
-        all_predictions = np.empty((0, ) + predictions.shape[1:])
+        all_predictions = []
         seqid_borders = list(test_sequence._get_seqid_borders(batch_idx))
         # get number of sequences for each seqid from border distance
         seqid_sizes = np.diff(np.array([0] + seqid_borders + [n_original_seqs]))
@@ -450,10 +540,11 @@ class HelixerModel(ABC):
                 # cut to the core
                 predictions_seqid = [s[seq_overhang:-seq_overhang] for s in predictions_seqid]
                 # generate zero'd out filler sequences for the start and end
-                filler_seqs = [np.zeros((self.core_length, 4))] * n_overhang_seqs
+                # (in the dtype of the predictions, so stacking does not upcast everything to float64)
+                filler_seqs = [np.zeros((self.core_length, 4), dtype=predictions.dtype)] * n_overhang_seqs
                 predictions_seqid = filler_seqs + predictions_seqid + filler_seqs
                 # stack eveything
-                predictions_seqid = np.stack(predictions_seqid).astype(predictions.dtype)
+                predictions_seqid = np.stack(predictions_seqid)
                 # add overhang edge data from first/last seq that can not be overlapped
                 predictions_seqid[0, :seq_overhang] = first[:seq_overhang]
                 predictions_seqid[-1, -seq_overhang:] = last[-seq_overhang:]
@@ -473,20 +564,37 @@ class HelixerModel(ABC):
                 # (causes values to be lower there)
                 averages = np.mean(stacked, axis=0)
                 predictions_seqid = np.stack(np.split(averages, seqid_size))
-            all_predictions = np.concatenate([all_predictions, predictions_seqid], axis=0)
+            all_predictions.append(predictions_seqid)
+        # concatenate once at the end, growing the array per seqid would copy it every time
+        all_predictions = np.concatenate(all_predictions, axis=0)
         assert all_predictions.shape[0] == n_original_seqs
         return all_predictions
 
+    def _batches(self, sequence):
+        """Yields all batches of sequence in order, read ahead by self.workers threads if set"""
+        if self.workers == 0:
+            for i in range(len(sequence)):
+                yield sequence[i]
+        else:
+            enqueuer = OrderedEnqueuer(sequence, use_multiprocessing=False)
+            enqueuer.start(workers=self.workers, max_queue_size=10)
+            batches = enqueuer.get()
+            try:
+                for _ in range(len(sequence)):
+                    yield next(batches)
+            finally:
+                enqueuer.stop()
+
     def _make_predictions(self, model):
         # loop through batches and continuously expand output dataset as everything might
         # not fit in memory
         pred_out = h5py.File(self.prediction_output_path, 'w')
         test_sequence = self.gen_test_data()
 
-        for i in range(len(test_sequence)):
+        for i, batch in enumerate(self._batches(test_sequence)):
             if self.verbose:
                 print(i, '/', len(test_sequence), end='\r')
-            predictions = model.predict_on_batch(test_sequence[i][0])
+            predictions = model.predict_on_batch(batch[0])
             # join last two dims when predicting one hot labels
             predictions = predictions.reshape(predictions.shape[:2] + (-1,))
             # reshape when predicting more than one point at a time
@@ -508,6 +616,10 @@ class HelixerModel(ABC):
             if self.overlap and predictions.shape[0] > 1:
                 predictions = self._overlap_predictions(i, test_sequence, predictions)
 
+            if self.prediction_dtype == 'uint8':
+                # quantize the softmax values in [0, 1] to 256 steps, multiply by the 'scale' attr to restore
+                predictions = np.rint(predictions * 255).astype(np.uint8)
+
             # prepare h5 dataset and save the predictions to disk
             if i == 0:
                 old_len = 0
@@ -515,24 +627,25 @@ class HelixerModel(ABC):
                                         data=predictions,
                                         maxshape=(None,) + predictions.shape[1:],
                                         chunks=(1,) + predictions.shape[1:],
-                                        dtype='float32',
+                                        dtype=self.prediction_dtype,
                                         compression='lzf',
                                         shuffle=True)
+                if self.prediction_dtype == 'uint8':
+                    pred_out['/predictions'].attrs['scale'] = 1 / 255
             else:
                 old_len = pred_out['/predictions'].shape[0]
                 pred_out['/predictions'].resize(old_len + predictions.shape[0], axis=0)
             pred_out['/predictions'][old_len:] = predictions
 
         # add model config and other attributes to predictions
-        h5_model = h5py.File(self.load_model_path, 'r')
-        pred_out.attrs['model_config'] = h5_model.attrs['model_config']
+        # the config of the already loaded model, instead of reopening the model file for it
+        pred_out.attrs['model_config'] = model.to_json()
         pred_out.attrs['n_bases_removed'] = n_removed
         pred_out.attrs['test_data_path'] = self.test_data
         pred_out.attrs['model_path'] = self.load_model_path
         pred_out.attrs['timestamp'] = str(datetime.datetime.now())
         pred_out.attrs['model_md5sum'] = self.loaded_model_hash
         pred_out.close()
-        h5_model.close()
 
     def _load_helixer_model(self):
         model = load_model(self.load_model_path, custom_objects={
@@ -597,13 +710,16 @@ class HelixerModel(ABC):
                 model = multi_gpu_model(model, gpus=self.gpus)
             self._print_model_info(model)
 
-            self.optimizer = optimizers.Adam(lr=self.learning_rate, clipnorm=self.clip_norm)
+            self.set_optimizer()
             self.compile_model(model)
 
+            # with workers > 0 the next batches are read from h5 by threads while the current one is on the gpu
+            # threads instead of processes, as the h5 files are opened before and shared with the sequences
             model.fit_generator(generator=self.gen_training_data(),
                                 epochs=self.epochs,
-                                workers=0,  # run in main thread
-                                # workers=1,
+                                workers=self.workers,  # 0 runs in main thread
+                                use_multiprocessing=False,
+                                max_queue_size=10,
                                 # validation_data=self.gen_validation_data(),
                                 callbacks=self.generate_callbacks(),
                                 verbose=True)
@@ -53,11 +53,10 @@ class LSTMSequence(HelixerSequence):
                 # giving even more weight to transition points
                 # class weights without pooling not supported yet
                 # cw = np.array([0.8, 1.4, 1.2, 1.2], dtype=np.float32)
-                cls_arrays = [np.any((y[:, :, :, col] == 1), axis=2) for col in range(4)]
-                cls_arrays = np.stack(cls_arrays, axis=2).astype(np.int8)
-                # add class weights to applicable timesteps
-                cw_arrays = np.multiply(cls_arrays, np.tile(self.class_weights, y.shape[:2] + (1,)))
-                cw = np.sum(cw_arrays, axis=2)
+                # whether a class is present anywhere in the pooled timestep
+                cls_arrays = np.any(y == 1, axis=2).astype(np.int8)
+                # add class weights to applicable timesteps, summing over classes without an intermediate array
+                cw = np.einsum('btc,c->bt', cls_arrays, self.class_weights)
                 # multiply with previous sample weights
                 sw = np.multiply(sw, cw)
 
@@ -110,8 +109,7 @@ class LSTMSequence(HelixerSequence):
 
     @staticmethod
     def _squish_tw_to_sw(transitions, tw, stretch):
-        sw_t = [np.any((transitions[:, :, :, col] == 1), axis=2) for col in range(6)]
-        sw_t = np.stack(sw_t, axis=2).astype(np.int8)
+        sw_t = np.any(transitions == 1, axis=2).astype(np.int8)
         sw_t = np.multiply(sw_t, tw)
 
         sw_t = np.sum(sw_t, axis=2)
@@ -18,10 +18,12 @@ from ..core import helpers
 from ..export import numerify
 from ..export.numerify import SequenceNumerifier, AnnotationNumerifier, Stepper, AMBIGUITY_DECODE
 from ..export.exporter import HelixerExportController
+from ..export import compress_x
 from ..prediction.ConfusionMatrix import ConfusionMatrix
 from helixer.prediction.HelixerModel import HelixerModel, HelixerSequence
 from helixer.prediction.LSTMModel import LSTMSequence
 from ..evaluation import rnaseq
+from ..evaluation.coverage_counter import CoverageCounter
 
 TMP_DB = 'testdata/tmp.db'
 DUMMYLOCI_DB = 'testdata/dummyloci.sqlite3'
@@ -1092,6 +1094,42 @@ def test_coverage_in_bits():
     h5.close()
 
 
+def test_coverage_counter():
+    # coverage bins are [0, 1, 2], counts are for coverage greater or equal to each bin
+    cov_counter = CoverageCounter(lab_dim=2, n_cov_bins=3, base_cov_bins=2)
+    assert cov_counter.coverage_bins == (0, 1, 2)
+    eye = np.eye(2, dtype=np.int8)
+    cov_counter.latest = {
+        'y': eye[[0, 1, 1, 1]],
+        'predictions': eye[[0, 0, 1, 1]].astype(np.float32),
+        'coverage': np.array([5, 0, -1, 2]),
+        'spliced_coverage': np.array([1, 0, 0, 5]),
+    }
+    cov_counter.increment()
+
+    expected = np.zeros((2, 2, 3, 3), dtype=np.int64)
+    expected[0, 0, :3, :2] += 1  # coverage 5 >= 0, 1, 2; spliced coverage 1 >= 0, 1
+    expected[1, 0, 0, 0] += 1  # coverage and spliced coverage 0 only reach the first bin
+    # the third base has coverage -1, below the lowest bin, so it is not counted at all
+    expected[1, 1, :3, :3] += 1  # coverage 2 and spliced coverage 5 reach every bin
+    assert np.array_equal(cov_counter.counts, expected)
+
+    # incrementing again adds to the existing counts
+    cov_counter.increment()
+    assert np.array_equal(cov_counter.counts, expected * 2)
+
+    flat = cov_counter.flatten()
+    assert flat[0] == ['argmax_y', 'argmax_pred', 'coverage_greater_eq', 'spliced_coverage_greater_eq', 'count']
+    assert len(flat) == 1 + 2 * 2 * 3 * 3
+    rows = {tuple(row[:4]): row[4] for row in flat[1:]}
+    assert rows[(0, 0, 2, 1)] == 2
+    assert rows[(0, 0, 2, 2)] == 0
+    assert rows[(1, 0, 0, 0)] == 2
+    assert rows[(1, 0, 1, 0)] == 0
+    assert rows[(1, 1, 2, 2)] == 2
+    assert rows[(0, 1, 0, 0)] == 0
+
+
 def test_super_chunking4write():
     """Tests that the exact same h5 is produced, regardless of how many super-chunks it is written in"""
     _, controller, _ = setup_dummyloci()
@@ -1140,6 +1178,66 @@ def test_super_chunking4write():
                           write_by=1001)  # write by should result in multiple super-chunks
 
 
+class SequenceTestModel(object):
+    """just the attributes a HelixerSequence copies from its model"""
+    def __init__(self):
+        self.batch_size = 4
+        self.float_precision = 'float32'
+        self.class_weights = None
+        self.transition_weights = None
+        self.stretch_transition_weights = 0
+        self.coverage_weights = False
+        self.coverage_offset = 0.0
+        self.overlap = False
+        self.overlap_offset = 2500
+        self.core_length = 10000
+        self.min_seqs_for_overlapping = 3
+        self.debug = False
+        self.exclude_errors = False
+        self.error_weights = False
+        self.gene_lengths = False
+        self.gene_lengths_average = 3350
+        self.gene_lengths_exponent = 1.0
+        self.gene_lengths_cutoff = 5.0
+        self.horovod = False
+
+
+def test_compressed_x():
+    """Tests that X compressed to uint8 codes is read back exactly as the original float16 X"""
+    _, controller, _ = setup_dummyloci()
+    controller.export(chunk_size=500, genomes='', exclude='', val_size=0.2, one_hot=True,
+                      all_transcripts=True, write_by=10_000_000_000)
+    compressed_path = H5_OUT_FOLDER + 'compressed_test_data.h5'
+    compress_x.main(H5_OUT_FILE, compressed_path, write_by=3)  # multiple pieces
+
+    f = h5py.File(H5_OUT_FILE, 'r')
+    f_compressed = h5py.File(compressed_path, 'r')
+    assert f_compressed['data/X'].dtype == np.uint8
+    assert f_compressed['data/X'].shape == f['data/X'].shape[:2]
+    # everything else is copied as is
+    assert np.array_equal(f_compressed['data/y'][:], f['data/y'][:])
+
+    model = SequenceTestModel()
+    sequence = LSTMSequence(model, f, 'test', shuffle=False)
+    sequence_compressed = LSTMSequence(model, f_compressed, 'test', shuffle=False)
+    assert sequence.x_decode_lut is None
+    assert sequence_compressed.x_decode_lut is not None
+    idx = np.arange(f['data/X'].shape[0])
+    x = sequence._get_x(idx)
+    x_compressed = sequence_compressed._get_x(idx)
+    assert x.dtype == x_compressed.dtype == np.float16
+    assert np.array_equal(x, x_compressed)
+
+    # padding and every ambiguity code also round trip
+    lut = compress_x.decode_lut()
+    x_all = np.array([[[0., 0., 0., 0.]] + list(AMBIGUITY_DECODE.values())], dtype=np.float16)
+    codes = compress_x.encode(x_all, lut)
+    assert codes[0, 0] == 0
+    assert np.array_equal(lut[codes], x_all)
+    f.close()
+    f_compressed.close()
+
+
 def test_rangefinder():
     _, controller, _ = setup_dummyloci()
     # dump the whole db in chunks into a .h5 file